@@ -1,12 +1,28 @@
+import argparse
+import atexit
+import hashlib
+import logging
+import logging.handlers
+import os
+import queue
+import sqlite3
 import threading
+import time
 from abc import ABC, abstractmethod
 from collections import OrderedDict
+from contextlib import closing
 from pathlib import Path
 
 import cv2
+import diskcache
+import numpy as np
+import orjson
 import pandas as pd
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+from turbojpeg import TJFLAG_PROGRESSIVE, TJPF_RGB, TurboJPEG
+from werkzeug.exceptions import HTTPException
 
 from vset_utils.vset_select import (
     get_annotation_options,
@@ -15,9 +31,86 @@ from vset_utils.vset_select import (
     get_videosets,
 )
 
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def _orjson_default(obj):
+    """Fallback for objects orjson can't serialize natively (numpy scalars, object arrays)."""
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+class OrjsonProvider(JSONProvider):
+    """JSON provider that serializes with orjson, including numpy arrays."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_orjson_default, option=ORJSON_OPTIONS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        data = orjson.dumps(obj, default=_orjson_default, option=ORJSON_OPTIONS)
+        return self._app.response_class(data, mimetype="application/json")
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
+# Log records are handed to a queue and written by a background thread, so request threads never block on I/O
+_log_queue = queue.SimpleQueue()
+logger = logging.getLogger("video_xt_tool")
+logger.setLevel(logging.INFO)
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+logger.propagate = False
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler())
+_log_listener.start()
+# Stopping the listener writes out records still in the queue
+atexit.register(_log_listener.stop)
+
+# Tracebacks of unhandled errors are logged at most once per endpoint and error type in this many seconds
+ERROR_LOG_INTERVAL = 10
+_error_log_state = {}  # (endpoint, error type) -> (last logged time, errors suppressed since)
+_error_log_lock = threading.Lock()
+
+
+JPEG_QUALITY = 80
+WEBP_QUALITY = 80
+# Frames with at least this many pixels (4K) are encoded on the GPU when nvjpeg is available.
+NVJPEG_MIN_PIXELS = 3840 * 2160
+
+_tj = TurboJPEG()
+
+try:
+    from nvjpeg import NvJpeg
+
+    _nvjpeg = NvJpeg()
+except ImportError:
+    _nvjpeg = None
+
+
+def encode_jpeg(frame):
+    """Encode an RGB frame to JPEG bytes, using nvjpeg for large frames if available."""
+    height, width = frame.shape[:2]
+    if _nvjpeg is not None and height * width >= NVJPEG_MIN_PIXELS:
+        # nvjpeg expects BGR input, like OpenCV
+        return _nvjpeg.encode(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR), JPEG_QUALITY)
+    return _tj.encode(
+        frame, quality=JPEG_QUALITY, pixel_format=TJPF_RGB, flags=TJFLAG_PROGRESSIVE
+    )
+
+
+def encode_webp(frame):
+    """Encode an RGB frame to WebP bytes."""
+    frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+    return cv2.imencode(".webp", frame, [cv2.IMWRITE_WEBP_QUALITY, WEBP_QUALITY])[1].tobytes()
+
+
+FRAME_ENCODERS = {"image/jpeg": encode_jpeg, "image/webp": encode_webp}
+
 
 class BaseCache(ABC):
     """Base class for thread-safe LRU caches with configurable size limits."""
@@ -25,7 +118,8 @@ class BaseCache(ABC):
     def __init__(self, max_len=100):
         self.cache = OrderedDict()
         self.max_len = max_len
-        self._lock = threading.Lock()
+        self._lock = threading.RLock()  # guards the cache structure, never held while computing
+        self._key_locks = {}  # one lock per key that is being computed
 
     def _evict_if_needed(self):
         """Remove oldest entries if cache exceeds max_len."""
@@ -34,12 +128,10 @@ class BaseCache(ABC):
 
     def _get_from_cache(self, key):
         """Get item from cache and mark as recently used."""
-        if key in self.cache:
-            # Move to end (most recently used)
-            value = self.cache.pop(key)
-            self.cache[key] = value
-            return value
-        return None
+        value = self.cache.get(key)
+        if value is not None:
+            self.cache.move_to_end(key)  # Mark as most recently used
+        return value
 
     def _put_in_cache(self, key, value):
         """Put item in cache and handle eviction."""
@@ -59,18 +151,57 @@ class BaseCache(ABC):
             cached_value = self._get_from_cache(key)
             if cached_value is not None:
                 return cached_value
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
 
-            # Cache miss - compute value
-            value = self._compute_value(*args, **kwargs)
-            self._put_in_cache(key, value)
+        # Cache miss - compute value. Concurrent misses for the same key wait for
+        # the first one and reuse its value, misses for other keys run in parallel.
+        with key_lock:
+            with self._lock:
+                cached_value = self._get_from_cache(key)
+            if cached_value is not None:
+                return cached_value
+            try:
+                value = self._compute_value(*args, **kwargs)
+                with self._lock:
+                    self._put_in_cache(key, value)
+            finally:
+                with self._lock:
+                    self._key_locks.pop(key, None)
             return value
 
+    def invalidate(self, *args, **kwargs):
+        """Drop the cached value for the given arguments, so the next get recomputes it."""
+        key = self._make_key(*args, **kwargs)
+        with self._lock:
+            self.cache.pop(key, None)
+
     @abstractmethod
     def _make_key(self, *args, **kwargs):
         """Create cache key from arguments. Must be implemented by subclasses."""
         pass
 
 
+class TTLCache(BaseCache):
+    """Base class for caches whose items expire ttl seconds after they were computed."""
+
+    def __init__(self, max_len=100, ttl=60):
+        super().__init__(max_len)
+        self.ttl = ttl
+
+    def _get_from_cache(self, key):
+        entry = super()._get_from_cache(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            del self.cache[key]
+            return None
+        return value
+
+    def _put_in_cache(self, key, value):
+        super()._put_in_cache(key, (time.monotonic() + self.ttl, value))
+
+
 class MediaManagerCache(BaseCache):
     """Cache for media manager instances."""
 
@@ -87,10 +218,10 @@ class MediaManagerCache(BaseCache):
 media_manager_cache = MediaManagerCache()
 
 
-class FrameCache(BaseCache):
-    """Cache for video frames."""
+class RawFrameCache(BaseCache):
+    """Small cache for decoded video frames, for code that needs the pixels."""
 
-    def __init__(self, max_len=100):
+    def __init__(self, max_len=4):
         super().__init__(max_len)
 
     def _make_key(self, videoset, camera, timestamp):
@@ -102,7 +233,158 @@ class FrameCache(BaseCache):
         return frame
 
 
-frame_cache = FrameCache()
+raw_frame_cache = RawFrameCache()
+
+
+class FrameCache(BaseCache):
+    """Cache for encoded video frames, stored as (frame_shape, image_bytes).
+
+    Misses are looked up in a disk cache shared by all server processes before
+    the frame is decoded and encoded.
+    """
+
+    def __init__(self, shared, max_len=1000):
+        super().__init__(max_len)
+        self.shared = shared
+
+    def _make_key(self, videoset, camera, timestamp, mimetype="image/jpeg"):
+        return (videoset, camera, timestamp, mimetype)
+
+    def _compute_value(self, videoset, camera, timestamp, mimetype="image/jpeg"):
+        key = self._make_key(videoset, camera, timestamp, mimetype)
+        value = self.shared.get(key)
+        if value is None:
+            frame = raw_frame_cache.get(videoset, camera, timestamp)
+            value = (frame.shape, FRAME_ENCODERS[mimetype](frame))
+            self.shared.set(key, value)
+        return value
+
+
+frame_cache = FrameCache(diskcache.Cache("./cache/frames", size_limit=2 * 1024**3))
+
+
+class FrameTimestampsCache(BaseCache):
+    """Cache for the sorted frame timestamps of a camera."""
+
+    def __init__(self, max_len=20):
+        super().__init__(max_len)
+
+    def _make_key(self, videoset, camera):
+        return (videoset, camera)
+
+    def _compute_value(self, videoset, camera):
+        mm = media_manager_cache.get(videoset, camera)
+        return np.sort(np.asarray(mm.timestamps, dtype=np.float64))
+
+
+frame_timestamps_cache = FrameTimestampsCache()
+
+
+class TimestampsPayloadCache(BaseCache):
+    """Cache for serialized /timestamps responses."""
+
+    def __init__(self, max_len=20):
+        super().__init__(max_len)
+
+    def _make_key(self, videoset, camera):
+        return (videoset, camera)
+
+    def _compute_value(self, videoset, camera):
+        mm = media_manager_cache.get(videoset, camera)
+        return orjson.dumps(np.asarray(mm.timestamps, dtype=np.float64), option=ORJSON_OPTIONS)
+
+
+timestamps_payload_cache = TimestampsPayloadCache()
+
+
+def nearest_frame_timestamp(videoset, camera, timestamp):
+    """Snap a timestamp to the nearest frame timestamp, so nearby requests share cache entries."""
+    timestamps = frame_timestamps_cache.get(videoset, camera)
+    if len(timestamps) == 0:
+        return timestamp
+    i = np.searchsorted(timestamps, timestamp)
+    if i == len(timestamps) or (i > 0 and timestamp - timestamps[i - 1] <= timestamps[i] - timestamp):
+        i -= 1
+    return float(timestamps[i])
+
+
+# Timestamps are matched after rounding to this many decimals, so float noise doesn't break lookups
+TIMESTAMP_DECIMALS = 6
+
+
+def _downcast(values):
+    """Downcast float64 to float32 and int64 to int32 to halve their size, if no value changes."""
+    if values.dtype == np.float64:
+        downcast = values.astype(np.float32)
+        if np.array_equal(downcast, values, equal_nan=True):
+            return downcast
+        return values
+    if values.dtype == np.int64 and len(values) > 0:
+        info = np.iinfo(np.int32)
+        if info.min <= values.min() and values.max() <= info.max:
+            return values.astype(np.int32)
+    return values
+
+
+def _column_array(values):
+    """Return column values as a contiguous array that orjson can serialize without Python objects."""
+    if values.dtype == object and pd.api.types.infer_dtype(values, skipna=True) in (
+        "integer",
+        "floating",
+        "mixed-integer-float",
+    ):
+        values = values.astype(np.float64)
+    return np.ascontiguousarray(_downcast(values))
+
+
+def _plot_array(values):
+    """Return a y/z plot column with float64 values as float32, precise enough to draw."""
+    if values.dtype == np.float64:
+        return values.astype(np.float32)
+    return values
+
+
+class TimestampedColumns:
+    """Columns of a table as numpy arrays, sorted by timestamp for fast lookups."""
+
+    def __init__(self, df):
+        # Timestamps are kept as full-precision float64, they are used for exact lookups
+        timestamps = df["timestamp"].to_numpy(dtype=np.float64)
+        # Sort column by column instead of copying the whole frame, and not at all when already sorted
+        order = None
+        if len(timestamps) > 1 and not (timestamps[1:] >= timestamps[:-1]).all():
+            order = np.argsort(timestamps, kind="stable")
+        self.columns = {}
+        for column in df.columns:
+            values = timestamps if column == "timestamp" else df[column].to_numpy()
+            if order is not None:
+                values = values[order]
+            self.columns[column] = (
+                np.ascontiguousarray(values)
+                if column == "timestamp"
+                else _column_array(values)
+            )
+        self.timestamps = self.columns["timestamp"]
+        self._names = list(self.columns)
+        # Map each (rounded) timestamp to its row range, rows with equal timestamps are adjacent
+        keys, starts, counts = np.unique(
+            np.round(self.timestamps, TIMESTAMP_DECIMALS), return_index=True, return_counts=True
+        )
+        self._row_ranges = {
+            key: (start, start + count)
+            for key, start, count in zip(keys.tolist(), starts.tolist(), counts.tolist())
+        }
+
+    def records_at(self, timestamp):
+        """Return the rows with the given timestamp as records."""
+        key = float(np.round(timestamp, TIMESTAMP_DECIMALS))
+        start, stop = self._row_ranges.get(key, (0, 0))
+        if start == stop:
+            return []
+        names = self._names
+        # Iterating the slices yields numpy scalars, which orjson writes at their own precision
+        rows = zip(*(self.columns[name][start:stop] for name in names))
+        return [dict(zip(names, row)) for row in rows]
 
 
 class TimeSeriesCache(BaseCache):
@@ -116,12 +398,41 @@ class TimeSeriesCache(BaseCache):
 
     def _compute_value(self, videoset_name, camera, timeseries_name):
         mm = media_manager_cache.get(videoset_name, camera)
-        return mm.load(timeseries_name)
+        df = mm.load(timeseries_name)
+        return None if df is None else TimestampedColumns(df)
 
 
 timeseries_cache = TimeSeriesCache()
 
 
+class TimeseriesPayloadCache(BaseCache):
+    """Cache for serialized /timeseries_data responses, stored as (etag, json_bytes)."""
+
+    def __init__(self, max_len=20):
+        super().__init__(max_len)
+
+    def _make_key(self, videoset_name, camera, timeseries_name, y_column, z_column):
+        return (videoset_name, camera, timeseries_name, y_column, z_column)
+
+    def _compute_value(self, videoset_name, camera, timeseries_name, y_column, z_column):
+        table = timeseries_cache.get(videoset_name, camera, timeseries_name)
+        if table is None:
+            return None
+        columns = table.columns
+
+        data = {"x": table.timestamps}
+        if y_column and y_column in columns:
+            data["y"] = _plot_array(columns[y_column])
+        if z_column and z_column in columns:
+            data["z"] = _plot_array(columns[z_column])
+
+        json_bytes = orjson.dumps(data, default=_orjson_default, option=ORJSON_OPTIONS)
+        return (hashlib.blake2b(json_bytes, digest_size=8).hexdigest(), json_bytes)
+
+
+timeseries_payload_cache = TimeseriesPayloadCache()
+
+
 class FrameSizeCache(BaseCache):
     """Cache for frame dimensions."""
 
@@ -132,54 +443,204 @@ class FrameSizeCache(BaseCache):
         return (videoset, camera)
 
     def _compute_value(self, videoset, camera):
-        frame = frame_cache.get(videoset, camera, 0)  # get first frame
-        height, width = frame.shape[:2]
+        frame_shape, _ = frame_cache.get(videoset, camera, 0)  # get first frame
+        height, width = frame_shape[:2]
         return (width, height)
 
 
 frame_size_cache = FrameSizeCache()
 
 
-class AnnotationCache(BaseCache):
-    """Cache for annotations."""
+def annotations_path(videoset_name, camera, annotation_suffix):
+    """Path of the annotation file written by /save_annotations."""
+    return Path(
+        f"./data/annotations/{videoset_name}/{camera.replace('/', '___')}_{annotation_suffix}.csv"
+    )
 
-    def __init__(self, max_len=20):
-        super().__init__(max_len)
+
+class AnnotationCache(TTLCache):
+    """Cache for annotations, refreshed every few seconds to pick up saves made by other workers."""
+
+    def __init__(self, max_len=20, ttl=10):
+        super().__init__(max_len, ttl)
 
     def _make_key(self, videoset_name, camera, annotation_suffix):
         return (videoset_name, camera, annotation_suffix)
 
     def _compute_value(self, videoset_name, camera, annotation_suffix):
         mm = media_manager_cache.get(videoset_name, camera)
-        return mm.load_annotations(annotation_suffix)
+        df = mm.load_annotations(annotation_suffix)
+        return None if df is None else TimestampedColumns(df)
 
 
 annotation_cache = AnnotationCache()
 
 
+class VideosetsCache(TTLCache):
+    """Cache for the serialized videoset listing, refreshed every minute to pick up new videosets."""
+
+    def __init__(self, max_len=1, ttl=60):
+        super().__init__(max_len, ttl)
+
+    def _make_key(self):
+        return ()
+
+    def _compute_value(self):
+        videosets = get_videosets()
+        payload = {name: {"cameras": videosets[name].cameras} for name in videosets.names}
+        return orjson.dumps(payload, default=_orjson_default, option=ORJSON_OPTIONS)
+
+
+videosets_cache = VideosetsCache()
+
+
+class TimeseriesOptionsCache(TTLCache):
+    """Cache for the serialized timeseries options of a camera, refreshed every minute."""
+
+    def __init__(self, max_len=20, ttl=60):
+        super().__init__(max_len, ttl)
+
+    def _make_key(self, videoset_name, camera):
+        return (videoset_name, camera)
+
+    def _compute_value(self, videoset_name, camera):
+        mm = media_manager_cache.get(videoset_name, camera)
+        options = get_timeseries_options(mm)
+        options = [x for x in options if 'temp' not in x]
+        return orjson.dumps(options, default=_orjson_default, option=ORJSON_OPTIONS)
+
+
+timeseries_options_cache = TimeseriesOptionsCache()
+
+
+class TmpAnnotationStore:
+    """SQLite store for annotations saved per timestamp that are not yet merged into the annotation file."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tmp_annotations ("
+                "videoset TEXT, camera TEXT, annotation_suffix TEXT, timestamp REAL, annotations BLOB, "
+                "PRIMARY KEY (videoset, camera, annotation_suffix, timestamp))"
+            )
+
+    def put(self, videoset, camera, annotation_suffix, timestamp, annotations):
+        """Store the annotations for one timestamp, replacing any saved before."""
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO tmp_annotations VALUES (?, ?, ?, ?, ?)",
+                (videoset, camera, annotation_suffix, timestamp, orjson.dumps(annotations)),
+            )
+
+    def get(self, videoset, camera, annotation_suffix, timestamp):
+        """Return the JSON-encoded annotations for one timestamp, or None if none were saved."""
+        with closing(sqlite3.connect(self.path)) as conn:
+            row = conn.execute(
+                "SELECT annotations FROM tmp_annotations "
+                "WHERE videoset = ? AND camera = ? AND annotation_suffix = ? AND timestamp = ?",
+                (videoset, camera, annotation_suffix, timestamp),
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def items(self, videoset, camera, annotation_suffix):
+        """Return (timestamp, annotations) for every saved timestamp."""
+        with closing(sqlite3.connect(self.path)) as conn:
+            rows = conn.execute(
+                "SELECT timestamp, annotations FROM tmp_annotations "
+                "WHERE videoset = ? AND camera = ? AND annotation_suffix = ?",
+                (videoset, camera, annotation_suffix),
+            ).fetchall()
+        return [(timestamp, orjson.loads(annotations)) for timestamp, annotations in rows]
+
+    def clear(self, videoset, camera, annotation_suffix):
+        """Remove all saved timestamps."""
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.execute(
+                "DELETE FROM tmp_annotations WHERE videoset = ? AND camera = ? AND annotation_suffix = ?",
+                (videoset, camera, annotation_suffix),
+            )
+
+    def import_files(self, root):
+        """Move per-timestamp CSV files from the old tmp_annotations directory layout into the store.
+
+        Files are laid out as <root>/<videoset>/<camera with '/' as '___'>_<suffix>/<timestamp>.csv.
+        Rows already in the store are newer and are kept.
+        """
+        for path in sorted(Path(root).glob("*/*/*.csv")):
+            try:
+                annotations = pd.read_csv(path).to_json(orient="records").encode()
+            except FileNotFoundError:
+                continue  # already moved by another import
+            except (pd.errors.EmptyDataError, pd.errors.ParserError):
+                # Clearing a frame wrote an empty file
+                annotations = orjson.dumps([])
+            encoded_camera, annotation_suffix = path.parent.name.rsplit("_", 1)
+            with closing(sqlite3.connect(self.path)) as conn, conn:
+                conn.execute(
+                    "INSERT OR IGNORE INTO tmp_annotations VALUES (?, ?, ?, ?, ?)",
+                    (
+                        path.parent.parent.name,
+                        encoded_camera.replace("___", "/"),
+                        annotation_suffix,
+                        float(path.stem),
+                        annotations,
+                    ),
+                )
+            path.unlink(missing_ok=True)
+
+
+tmp_annotation_store = TmpAnnotationStore("./data/tmp_annotations.db")
+
+
+@app.errorhandler(Exception)
+def handle_exception(e):
+    """Log unhandled errors (rate limited) and return them as JSON, HTTP errors pass through unchanged."""
+    if isinstance(e, HTTPException):
+        return e
+    key = (request.endpoint, type(e))
+    now = time.monotonic()
+    with _error_log_lock:
+        last_logged, suppressed = _error_log_state.get(key, (None, 0))
+        log_now = last_logged is None or now - last_logged >= ERROR_LOG_INTERVAL
+        _error_log_state[key] = (now, 0) if log_now else (last_logged, suppressed + 1)
+    if log_now:
+        logger.exception(
+            "Unhandled error in %s %s (%d similar errors not logged)",
+            request.method,
+            request.path,
+            suppressed,
+        )
+    return jsonify({"error": str(e)}), 500
+
+
+@app.route("/health", methods=["GET"])
+def health():
+    return jsonify({"status": "ok"})
+
+
 @app.route("/videosets", methods=["GET"])
 def videosets():
-    videosets = get_videosets()
-    data = {name: {"cameras": videosets[name].cameras} for name in videosets.names}
-    return jsonify(data)
+    return Response(videosets_cache.get(), mimetype="application/json")
 
 
 @app.route("/timestamps", methods=["GET"])
 def get_timestamps():
     videoset_name = request.args.get("videoset_name")
     camera = request.args.get("camera")
-    mm = media_manager_cache.get(videoset_name, camera)
-    return jsonify(mm.timestamps)
+    return Response(
+        timestamps_payload_cache.get(videoset_name, camera), mimetype="application/json"
+    )
 
 
 @app.route("/timeseries_options", methods=["GET"])
 def timeseries_options():
     videoset_name = request.args.get("videoset_name")
     camera = request.args.get("camera")
-    mm = media_manager_cache.get(videoset_name, camera)
-    options = get_timeseries_options(mm)
-    options = [x for x in options if 'temp' not in x]
-    return jsonify(options)
+    return Response(
+        timeseries_options_cache.get(videoset_name, camera), mimetype="application/json"
+    )
 
 
 @app.route("/timeseries_data", methods=["GET"])
@@ -190,17 +651,17 @@ def get_timeseries_data():
     y_column = request.args.get("y_column")
     z_column = request.args.get("z_column")
 
-    df = timeseries_cache.get(videoset_name, camera, timeseries_name)
-    if df is None:
+    payload = timeseries_payload_cache.get(
+        videoset_name, camera, timeseries_name, y_column, z_column
+    )
+    if payload is None:
         return jsonify({"error": "Timeseries not found"}), 404
 
-    data = {"x": df["timestamp"].tolist()}
-    if y_column and y_column in df.columns:
-        data["y"] = df[y_column].tolist()
-    if z_column and z_column in df.columns:
-        data["z"] = df[z_column].tolist()
-
-    return jsonify(data)
+    etag, json_bytes = payload
+    headers = {"Cache-Control": "no-cache", "ETag": f'"{etag}"'}
+    if request.if_none_match.contains(etag):
+        return ("", 304, headers)
+    return Response(json_bytes, mimetype="application/json", headers=headers)
 
 
 @app.route("/column_options", methods=["GET"])
@@ -208,20 +669,32 @@ def get_column_options():
     videoset_name = request.args.get("videoset_name")
     camera = request.args.get("camera")
     timeseries_name = request.args.get("timeseries_name")
-    mm = media_manager_cache.get(videoset_name, camera)
-    df = mm.load(timeseries_name)
-    if df is None:
+    table = timeseries_cache.get(videoset_name, camera, timeseries_name)
+    if table is None:
         return jsonify({"error": "Timeseries not found"}), 404
-    return jsonify(df.columns.tolist())
+    return jsonify(list(table.columns))
 
 
 @app.route("/frame/<videoset_name>/<camera>/<timestamp>", methods=["GET"])
 def get_frame(videoset_name, camera, timestamp):
     camera = camera.replace("___", "/")
-    frame = frame_cache.get(videoset_name, camera, float(timestamp))
-    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    jpg_bytes = cv2.imencode(".jpg", frame)[1].tobytes()
-    return (jpg_bytes, 200, {"Content-Type": "image/jpeg"})
+    timestamp = nearest_frame_timestamp(videoset_name, camera, float(timestamp))
+    # Serve WebP only to clients that list it explicitly, JPEG otherwise
+    mimetype = request.accept_mimetypes.best_match(list(FRAME_ENCODERS), "image/jpeg")
+    # Frames never change, so the browser may keep them and revalidate by ETag
+    etag = hashlib.blake2b(
+        f"{videoset_name}|{camera}|{timestamp}|{mimetype}".encode(), digest_size=8
+    ).hexdigest()
+    headers = {
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "ETag": f'"{etag}"',
+        "Vary": "Accept",
+    }
+    if request.if_none_match.contains(etag):
+        return ("", 304, headers)
+
+    _, image_bytes = frame_cache.get(videoset_name, camera, timestamp, mimetype)
+    return (image_bytes, 200, {"Content-Type": mimetype, **headers})
 
 
 @app.route("/frame_size", methods=["GET"])
@@ -241,16 +714,18 @@ def get_annotations():
     y_column = request.args.get(
         "y_column", "bbox_y"
     )  # Default to bbox_y if not specified
-    mm = media_manager_cache.get(videoset_name, camera)
-    df = mm.load_annotations(annotation_suffix)
+    table = annotation_cache.get(videoset_name, camera, annotation_suffix)
+    if table is None:
+        return jsonify({"error": "Annotations not found"}), 404
+    columns = table.columns
 
     data = {
-        "x": df["timestamp"].tolist(),
-        "y": df[y_column].tolist() if y_column in df.columns else [],
+        "x": table.timestamps,
+        "y": _plot_array(columns[y_column]) if y_column in columns else [],
     }
     # Add z column if bbox_x exists (for completeness)
-    if "bbox_x" in df.columns:
-        data["z"] = df["bbox_x"].tolist()
+    if "bbox_x" in columns:
+        data["z"] = _plot_array(columns["bbox_x"])
 
     return jsonify(data)
 
@@ -263,24 +738,15 @@ def get_annotation_at_timestamp():
     timestamp = request.args.get("timestamp", type=float)
     
     # check if there are tmp annotations
-    tmp_filename = f"./data/tmp_annotations/{videoset_name}/{camera.replace('/', '___')}_{annotation_suffix}/{timestamp}.csv"
-    if Path(tmp_filename).exists():
-        df = pd.read_csv(tmp_filename)
-        data = df.to_dict("records")
-        return jsonify(data)
-
-    mm = media_manager_cache.get(videoset_name, camera)
-    assert mm is not None, f"MediaManager not found for {videoset_name} {camera}"
-    df = mm.load_annotations(annotation_suffix)
+    tmp_annotations = tmp_annotation_store.get(videoset_name, camera, annotation_suffix, timestamp)
+    if tmp_annotations is not None:
+        return Response(tmp_annotations, mimetype="application/json")
 
-    # Filter by timestamp
-    filtered_df = df[df["timestamp"] == timestamp]
-
-    if filtered_df.empty:
+    table = annotation_cache.get(videoset_name, camera, annotation_suffix)
+    if table is None:
         return jsonify([])
 
-    # Convert to records format similar to timeseries_at_timestamp
-    data = filtered_df.to_dict("records")
+    data = table.records_at(timestamp)
     return jsonify(data)
 
 
@@ -292,10 +758,7 @@ def save_annotations_at_timestamp():
     annotation_suffix = data.get("annotation_suffix")
     timestamp = float(data.get("timestamp"))
     annotations = data.get("annotations", [])
-    filename = f"./data/tmp_annotations/{videoset_name}/{camera.replace('/', '___')}_{annotation_suffix}/{timestamp}.csv"
-    Path(filename).parent.mkdir(parents=True, exist_ok=True)
-    df = pd.DataFrame(annotations)
-    df.to_csv(filename, index=False)
+    tmp_annotation_store.put(videoset_name, camera, annotation_suffix, timestamp, annotations)
     return jsonify({"success": True})
 
 
@@ -306,46 +769,40 @@ def save_annotations():
     camera = data.get("camera")
     annotation_suffix = data.get("annotation_suffix")
     # read tmp annotations
-    tmp_dir = Path(
-        f"./data/tmp_annotations/{videoset_name}/{camera.replace('/', '___')}_{annotation_suffix}"
-    )
-    all_dfs = []
-    for csv_file in tmp_dir.glob("*.csv"):
-        df = pd.read_csv(csv_file)
-        all_dfs.append(df)
-    if all_dfs:
-        new_annotations = pd.concat(all_dfs, ignore_index=True)
-        old_annotations = annotation_cache.get(videoset_name, camera, annotation_suffix)
+    tmp_annotations = tmp_annotation_store.items(videoset_name, camera, annotation_suffix)
+    if tmp_annotations:
+        saved_timestamps = [timestamp for timestamp, _ in tmp_annotations]
+        new_annotations = pd.DataFrame(
+            [row for _, annotations in tmp_annotations for row in annotations]
+        )
+        # Merge against a fresh load, the cached table can lag behind saves made by other workers
+        mm = media_manager_cache.get(videoset_name, camera)
+        old_annotations = mm.load_annotations(annotation_suffix)
         if old_annotations is None:
-            print(new_annotations)
+            num_kept = 0
         else:
+            # Saved timestamps replace all old annotations at that timestamp, also when cleared
             old_annotations_to_keep = old_annotations[
-                ~old_annotations["timestamp"].isin(new_annotations["timestamp"])
+                ~old_annotations["timestamp"].isin(saved_timestamps)
             ]
+            num_kept = len(old_annotations_to_keep)
             new_annotations = pd.concat(
                 [old_annotations_to_keep, new_annotations], ignore_index=True
             )
-            print(new_annotations)
-        annotations_path = Path(
-            f"./data/annotations/{videoset_name}/{camera.replace('/', '___')}_{annotation_suffix}.csv"
+        # Formatted only when debug logging is enabled
+        logger.debug("Saving annotations for %s %s:\n%s", videoset_name, camera, new_annotations)
+        path = annotations_path(videoset_name, camera, annotation_suffix)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename, so other workers never read a half-written file
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        new_annotations.to_csv(tmp_path, index=False)
+        tmp_path.replace(path)
+        # Only this worker's cache is dropped, other workers pick the save up when their entry expires
+        annotation_cache.invalidate(videoset_name, camera, annotation_suffix)
+        tmp_annotation_store.clear(videoset_name, camera, annotation_suffix)
+        return jsonify(
+            {"success": True, "num_kept": num_kept, "num_created": len(new_annotations)}
         )
-        annotations_path.parent.mkdir(parents=True, exist_ok=True)
-        new_annotations.to_csv(annotations_path, index=False)
-        # remove tmp annotations
-        for csv_file in tmp_dir.glob("*.csv"):
-            csv_file.unlink()
-        if old_annotations is not None:
-            return jsonify(
-                {"success": True, "num_kept": 0, "num_created": len(new_annotations)}
-            )
-        else:
-            return jsonify(
-                {
-                    "success": True,
-                    "num_kept": len(old_annotations_to_keep),
-                    "num_created": len(new_annotations),
-                }
-            )
     else:
         return jsonify({"error": "No temporary annotations found"}), 400
 
@@ -357,26 +814,32 @@ def get_timeseries_at_timestamp():
     timeseries_name = request.args.get("timeseries_name")
     timestamp = request.args.get("timestamp", type=float)
     assert timeseries_name is not None, "timeseries_name is required"
-    df = timeseries_cache.get(videoset_name, camera, timeseries_name)
-    assert df is not None, f"{timeseries_name} not found for {videoset_name} {camera}"
-    data = df[df["timestamp"] == timestamp].to_dict("records")
+    table = timeseries_cache.get(videoset_name, camera, timeseries_name)
+    assert table is not None, f"{timeseries_name} not found for {videoset_name} {camera}"
+    data = table.records_at(timestamp)
     return jsonify(data)
 
 
 @app.route("/subsets", methods=["GET"])
 def get_subsets():
     subset_dir = Path("subsets")
-    subsets = [p.stem for p in subset_dir.glob("*.csv")]
+    # glob yields nothing when the directory doesn't exist yet
+    paths = [*subset_dir.glob("*.parquet"), *subset_dir.glob("*.csv")]
+    subsets = sorted({p.stem for p in paths})
     return jsonify(subsets)
 
 
 @app.route("/subset/<name>", methods=["GET"])
 def get_subset(name):
-    subset_path = Path("subsets") / f"{name}.csv"
-    if subset_path.exists():
-        df = pd.read_csv(subset_path)
-        return jsonify(df.to_dict("records"))
-    return jsonify({"error": "Subset not found"}), 404
+    parquet_path = Path("subsets") / f"{name}.parquet"
+    csv_path = Path("subsets") / f"{name}.csv"  # subsets saved before the switch to parquet
+    if parquet_path.exists():
+        df = pd.read_parquet(parquet_path, engine="pyarrow")
+    elif csv_path.exists():
+        df = pd.read_csv(csv_path)
+    else:
+        return jsonify({"error": "Subset not found"}), 404
+    return Response(df.to_json(orient="records"), mimetype="application/json")
 
 
 @app.route("/subset", methods=["POST"])
@@ -388,14 +851,13 @@ def save_subset():
         return jsonify({"error": "Invalid data"}), 400
 
     df = pd.DataFrame(subset_data)
-    subset_path = Path("subsets") / f"{name}.csv"
-    df.to_csv(subset_path, index=False)
+    subset_path = Path("subsets") / f"{name}.parquet"
+    df.to_parquet(subset_path, engine="pyarrow", compression="zstd")
     return jsonify({"success": True})
 
 
-@app.route("/annotations/options/<videoset>/<camera>", methods=["GET"])
-def annotation_options(videoset, camera):
-    camera = camera.replace("___", "/")
+def annotation_suffixes(videoset, camera):
+    """Return the annotation suffix of each annotation file of a camera, None for unsuffixed files."""
     mm = media_manager_cache.get(videoset, camera)
     options = get_annotation_options(mm)
     options = [x.stem for x in options if "tmp" not in str(x) and "old" not in str(x)]
@@ -408,8 +870,51 @@ def annotation_options(videoset, camera):
         parsed_options.append(suffix)
 
     # print(f"Annotation options for {videoset} {camera}: {options}")
-    return jsonify(parsed_options)
+    return parsed_options
+
+
+@app.route("/annotations/options/<videoset>/<camera>", methods=["GET"])
+def annotation_options(videoset, camera):
+    camera = camera.replace("___", "/")
+    return jsonify(annotation_suffixes(videoset, camera))
+
+
+@app.route("/annotations/options/batch", methods=["POST"])
+def annotation_options_batch():
+    """Annotation options for many sequences in one request, keyed by '<videoset>_<camera>'.
+
+    Sequences whose options can't be read map to null, so one bad sequence doesn't fail the batch.
+    """
+    data = request.get_json(silent=True)
+    pairs = data.get("pairs") if isinstance(data, dict) else None
+    if not isinstance(pairs, list) or not all(
+        isinstance(pair, dict)
+        and isinstance(pair.get("videoset"), str)
+        and isinstance(pair.get("camera"), str)
+        for pair in pairs
+    ):
+        return jsonify({"error": "Expected a JSON body {\"pairs\": [{\"videoset\", \"camera\"}, ...]}"}), 400
+
+    options = {}
+    for pair in pairs:
+        videoset, camera = pair["videoset"], pair["camera"]
+        try:
+            options[f"{videoset}_{camera}"] = annotation_suffixes(videoset, camera)
+        except Exception:
+            logger.exception("Failed to read annotation options for %s %s", videoset, camera)
+            options[f"{videoset}_{camera}"] = None
+    return jsonify(options)
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--import-tmp-annotations",
+        action="store_true",
+        help="move unsaved annotations from ./data/tmp_annotations into the SQLite store and exit",
+    )
+    if parser.parse_args().import_tmp_annotations:
+        tmp_annotation_store.import_files("./data/tmp_annotations")
+    else:
+        # Development server; run `gunicorn api:app` to serve with gunicorn.conf.py
+        app.run(debug=True)
@@ -0,0 +1,5 @@
+# Registered here so runs without pytest-xdist don't warn about the mark used in test_api.py
+def pytest_configure(config):
+	config.addinivalue_line(
+		"markers", "xdist_group(name): run tests of the same group on one pytest-xdist worker"
+	)
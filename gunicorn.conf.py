@@ -0,0 +1,9 @@
+# Production server settings, used by `gunicorn api:app`.
+# Worker processes share encoded frames through the disk cache in ./cache. Other caches are
+# per process. A save drops the annotation cache of the worker that handled it; other workers
+# serve their cached annotations until the entry expires, at most AnnotationCache.ttl seconds.
+
+bind = "127.0.0.1:5000"
+worker_class = "gthread"
+workers = 4
+threads = 8
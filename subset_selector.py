@@ -6,34 +6,53 @@ with annotation options.
 """
 
 import fnmatch
-from collections import defaultdict
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass, field
+from pathlib import Path
 from typing import Dict, List, Tuple
 
+import diskcache
+import orjson
+import pandas as pd
 import requests
 import streamlit as st
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
+from urllib3.util.retry import Retry
 
+JSON_HEADERS = {"Content-Type": "application/json"}
+# (connect, read) timeouts, so a hung backend is abandoned quickly
+REQUEST_TIMEOUT = (2, 5)
+# Batches open a media manager per sequence on the server, give them longer to answer
+BATCH_REQUEST_TIMEOUT = (2, 30)
+ANNOTATION_OPTIONS_CACHE_DIR = Path.home() / ".cache" / "video_xt_tool" / "annotation_options"
+ANNOTATION_OPTIONS_CACHE_EXPIRE = 3600
+ANNOTATION_OPTIONS_BATCH_SIZE = 50
+# Stays below the session's pool_maxsize, so workers don't wait on connections
+ANNOTATION_OPTIONS_WORKERS = 8
 
-@dataclass
-class SequenceEntry:
-    """Represents a video sequence with its annotation suffix."""
-    videoset: str
-    camera: str
-    annotation_suffix: str = "Undefined"
 
-    @property
-    def sequence_id(self) -> str:
-        """Unique identifier for the sequence."""
-        return f"{self.videoset}_{self.camera}"
+SUBSET_COLUMNS = ["videoset", "camera", "annotation_suffix"]
+
+
+def make_subset_frame(videosets: List[str], cameras: List[str], annotation_suffixes) -> pd.DataFrame:
+    """Build a subset table with one row per sequence and its sequence_id."""
+    df = pd.DataFrame(
+        {"videoset": videosets, "camera": cameras, "annotation_suffix": annotation_suffixes},
+        columns=SUBSET_COLUMNS,
+        dtype=object,
+    )
+    df["sequence_id"] = df["videoset"] + "_" + df["camera"]
+    return df
 
 
 @dataclass
 class SubsetSelectorState:
     """Manages the application state."""
     videosets: Dict = field(default_factory=dict)
-    current_subset_list: List[SequenceEntry] = field(default_factory=list)
-    sequences_per_suffix: Dict[str, List[str]] = field(default_factory=lambda: defaultdict(list))
+    current_subset_df: pd.DataFrame = field(default_factory=lambda: make_subset_frame([], [], []))
+    sequences_per_suffix: Dict[str, List[str]] = field(default_factory=dict)
 
 
 class APIClient:
@@ -41,72 +60,139 @@ class APIClient:
 
     def __init__(self, base_url: str = "http://localhost:5000"):
         self.base_url = base_url
+        # Pooled session, so repeated calls reuse keep-alive connections
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=32,
+            max_retries=Retry(
+                total=2,
+                backoff_factor=0.2,
+                status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset(["GET", "POST"]),
+            ),
+        )
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        # Annotation options rarely change, keep them on disk across sessions
+        self._annotation_options_cache = diskcache.Cache(str(ANNOTATION_OPTIONS_CACHE_DIR))
 
-    def get_available_videosets(self) -> Dict:
-        """Fetch available videosets from the API."""
-        try:
-            response = requests.get(f"{self.base_url}/videosets", timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except RequestException as e:
-            st.error(f"Failed to fetch videosets: {e}")
-            return {}
+    def clear_annotation_options_cache(self):
+        """Forget all cached annotation options."""
+        self._annotation_options_cache.clear()
 
-    def get_annotation_options(self, videoset: str, camera: str) -> List[str]:
-        """Fetch annotation options for a specific videoset and camera."""
-        try:
-            # URL encode camera path by replacing '/' with '___'
-            encoded_camera = camera.replace("/", "___")
-            response = requests.get(
-                f"{self.base_url}/annotations/options/{videoset}/{encoded_camera}",
-                timeout=10
-            )
-            response.raise_for_status()
-            return response.json()
-        except RequestException as e:
-            st.error(f"Failed to fetch annotation options for {videoset}/{camera}: {e}")
-            return []
+    def get_available_videosets(self) -> Dict:
+        """Fetch available videosets from the API, raising on failure."""
+        response = self._session.get(f"{self.base_url}/videosets", timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return orjson.loads(response.content)
+
+    def fetch_annotation_options_batch(self, pairs: List[Tuple[str, str]]) -> Dict[str, List[str]]:
+        """Fetch annotation options for many (videoset, camera) pairs, skipping cached pairs.
+
+        Raises instead of reporting errors, so it can run in worker threads.
+        """
+        cache = self._annotation_options_cache
+        options_per_sequence = {}
+        missing = []
+        for videoset, camera in pairs:
+            options = cache.get(f"{self.base_url}|{videoset}|{camera}")
+            if options is None:
+                missing.append((videoset, camera))
+            else:
+                options_per_sequence[f"{videoset}_{camera}"] = options
+        if not missing:
+            return options_per_sequence
+
+        response = self._session.post(
+            f"{self.base_url}/annotations/options/batch",
+            data=orjson.dumps({"pairs": [{"videoset": videoset, "camera": camera} for videoset, camera in missing]}),
+            headers=JSON_HEADERS,
+            timeout=BATCH_REQUEST_TIMEOUT
+        )
+        response.raise_for_status()
+        fetched = orjson.loads(response.content)
+        for videoset, camera in missing:
+            options = fetched.get(f"{videoset}_{camera}")
+            if options is not None:
+                cache.set(f"{self.base_url}|{videoset}|{camera}", options, expire=ANNOTATION_OPTIONS_CACHE_EXPIRE)
+        options_per_sequence.update(fetched)
+        return options_per_sequence
 
     def save_subset(self, name: str, subset_data: List[Dict]) -> bool:
         """Save a subset to the server."""
         try:
-            response = requests.post(
+            response = self._session.post(
                 f"{self.base_url}/subset",
-                json={"name": name, "data": subset_data},
-                timeout=10
+                data=orjson.dumps({"name": name, "data": subset_data}),
+                headers=JSON_HEADERS,
+                timeout=REQUEST_TIMEOUT
             )
             response.raise_for_status()
             return True
-        except RequestException as e:
+        except (RequestException, orjson.JSONDecodeError) as e:
             st.error(f"Failed to save subset '{name}': {e}")
             return False
 
     def get_available_subsets(self) -> List[str]:
-        """Get list of available saved subsets."""
-        try:
-            response = requests.get(f"{self.base_url}/subsets", timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except RequestException as e:
-            st.error(f"Failed to fetch available subsets: {e}")
-            return []
+        """Get list of available saved subsets, raising on failure."""
+        response = self._session.get(f"{self.base_url}/subsets", timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return orjson.loads(response.content)
 
     def load_subset(self, name: str) -> List[Dict]:
         """Load a subset from the server."""
         try:
-            response = requests.get(f"{self.base_url}/subset/{name}", timeout=10)
+            response = self._session.get(f"{self.base_url}/subset/{name}", timeout=REQUEST_TIMEOUT)
             response.raise_for_status()
-            return response.json()
-        except RequestException as e:
+            return orjson.loads(response.content)
+        except (RequestException, orjson.JSONDecodeError) as e:
             st.error(f"Failed to load subset '{name}': {e}")
             return []
 
 
+@st.cache_resource
+def _get_api_client(base_url: str = "http://localhost:5000") -> APIClient:
+    """One API client per server, so its connection pool survives reruns and sessions."""
+    return APIClient(base_url)
+
+
+# The cached fetches raise on failure. st.cache_data never stores exceptions, so the next rerun retries
+@st.cache_data(ttl=300)
+def _fetch_videosets(base_url: str) -> Dict:
+    """Videosets from the API, reused across reruns for five minutes."""
+    return _get_api_client(base_url).get_available_videosets()
+
+
+@st.cache_data(ttl=60)
+def _fetch_subsets(base_url: str) -> List[str]:
+    """Saved subset names from the API, reused across reruns for a minute."""
+    return _get_api_client(base_url).get_available_subsets()
+
+
+def _load_videosets(base_url: str) -> Dict:
+    """Cached videosets, or an empty dict after reporting why they couldn't be fetched."""
+    try:
+        return _fetch_videosets(base_url)
+    except (RequestException, orjson.JSONDecodeError) as e:
+        st.error(f"Failed to fetch videosets: {e}")
+        return {}
+
+
+def _load_subsets(base_url: str) -> List[str]:
+    """Cached subset names, or an empty list after reporting why they couldn't be fetched."""
+    try:
+        return _fetch_subsets(base_url)
+    except (RequestException, orjson.JSONDecodeError) as e:
+        st.error(f"Failed to fetch available subsets: {e}")
+        return []
+
+
 class SubsetSelector:
     """Main application class for subset selection."""
 
     def __init__(self):
-        self.api_client = APIClient()
+        self.api_client = _get_api_client()
         self._initialize_session_state()
 
     def _initialize_session_state(self):
@@ -116,7 +202,7 @@ class SubsetSelector:
 
         # Initialize videosets if not already loaded
         if not st.session_state.subset_selector_state.videosets:
-            st.session_state.subset_selector_state.videosets = self.api_client.get_available_videosets()
+            st.session_state.subset_selector_state.videosets = _load_videosets(self.api_client.base_url)
 
     @property
     def state(self) -> SubsetSelectorState:
@@ -143,18 +229,21 @@ class SubsetSelector:
             st.warning("No videosets available. Please check the API connection.")
             return
 
-        self.state.current_subset_list.clear()
-        available_videosets = fnmatch.filter(self.state.videosets.keys(), videoset_pattern)
+        # Translate each glob once instead of once per videoset
+        videoset_regex = re.compile(fnmatch.translate(videoset_pattern))
+        camera_regex = re.compile(fnmatch.translate(camera_pattern))
 
-        sequence_count = 0
-        for videoset in available_videosets:
-            cameras = self.state.videosets[videoset]["cameras"]
-            available_cameras = fnmatch.filter(cameras, camera_pattern)
-
-            for camera in available_cameras:
-                sequence = SequenceEntry(videoset=videoset, camera=camera)
-                self.state.current_subset_list.append(sequence)
-                sequence_count += 1
+        pairs = [
+            (videoset, camera)
+            for videoset, info in self.state.videosets.items()
+            if videoset_regex.match(videoset)
+            for camera in info["cameras"]
+            if camera_regex.match(camera)
+        ]
+        self.state.current_subset_df = make_subset_frame(
+            [videoset for videoset, _ in pairs], [camera for _, camera in pairs], "Undefined"
+        )
+        sequence_count = len(pairs)
 
         if sequence_count == 0:
             st.warning("No sequences found matching the specified patterns.")
@@ -163,26 +252,67 @@ class SubsetSelector:
 
     def fetch_annotation_options(self):
         """Fetch annotation options for all current sequences."""
-        if not self.state.current_subset_list:
+        if self.state.current_subset_df.empty:
             st.warning("No sequences selected. Please find matching sequences first.")
             return
 
         # Clear previous annotation data
-        self.state.sequences_per_suffix.clear()
+        sequences_per_suffix = self.state.sequences_per_suffix
+        sequences_per_suffix.clear()
 
         progress_bar = st.progress(0)
-        total_sequences = len(self.state.current_subset_list)
+        df = self.state.current_subset_df
+        pairs = list(zip(df["videoset"], df["camera"]))
+        total_sequences = len(pairs)
 
-        for i, sequence in enumerate(self.state.current_subset_list):
-            options = self.api_client.get_annotation_options(sequence.videoset, sequence.camera)
-
-            for option in options:
-                self.state.sequences_per_suffix[option].append(sequence.sequence_id)
+        batches = [
+            pairs[start:start + ANNOTATION_OPTIONS_BATCH_SIZE]
+            for start in range(0, total_sequences, ANNOTATION_OPTIONS_BATCH_SIZE)
+        ]
 
-            progress_bar.progress((i + 1) / total_sequences)
+        # Batches are fetched concurrently, Streamlit calls stay on this thread
+        done_sequences = 0
+        failed_batches = []
+        failed_sequences = []
+        with ThreadPoolExecutor(max_workers=ANNOTATION_OPTIONS_WORKERS) as executor:
+            futures = {
+                executor.submit(self.api_client.fetch_annotation_options_batch, batch): batch
+                for batch in batches
+            }
+            for future in as_completed(futures):
+                batch = futures[future]
+                try:
+                    options_per_sequence = future.result()
+                except (RequestException, orjson.JSONDecodeError) as e:
+                    failed_batches.append((batch, e))
+                    options_per_sequence = {}
+
+                for sequence_id, options in options_per_sequence.items():
+                    # The server returns null for sequences it couldn't read
+                    if options is None:
+                        failed_sequences.append(sequence_id)
+                        continue
+                    for option in options:
+                        sequences_per_suffix.setdefault(option, []).append(sequence_id)
+
+                done_sequences += len(batch)
+                progress_bar.progress(done_sequences / total_sequences)
 
         progress_bar.empty()
 
+        # Report all failures at once instead of rendering an error per batch
+        if failed_batches:
+            failed_count = sum(len(batch) for batch, _ in failed_batches)
+            st.warning(
+                f"Failed to fetch annotation options for {failed_count} sequences: "
+                + "; ".join(str(e) for _, e in failed_batches)
+            )
+        if failed_sequences:
+            st.warning(
+                f"Could not read annotation options for {len(failed_sequences)} sequences: "
+                + ", ".join(failed_sequences)
+            )
+
         if self.state.sequences_per_suffix:
             st.success(f"Found annotation options for {len(self.state.sequences_per_suffix)} suffixes")
         else:
@@ -210,20 +340,24 @@ class SubsetSelector:
                 st.session_state.show_load_dialog = True
                 st.rerun()
 
+    def _refresh(self):
+        """Drop cached API listings and reload the videosets."""
+        _fetch_videosets.clear()
+        _fetch_subsets.clear()
+        self.state.videosets = _load_videosets(self.api_client.base_url)
+
     def _clear_current_subset(self):
         """Clear all current subset data."""
-        self.state.current_subset_list.clear()
+        self.state.current_subset_df = make_subset_frame([], [], [])
         self.state.sequences_per_suffix.clear()
         st.rerun()
 
     def _remove_undefined_annotations(self):
         """Remove sequences with undefined annotation suffixes."""
-        initial_count = len(self.state.current_subset_list)
-        self.state.current_subset_list = [
-            seq for seq in self.state.current_subset_list
-            if seq.annotation_suffix != "Undefined"
-        ]
-        final_count = len(self.state.current_subset_list)
+        df = self.state.current_subset_df
+        initial_count = len(df)
+        self.state.current_subset_df = df[df["annotation_suffix"] != "Undefined"].reset_index(drop=True)
+        final_count = len(self.state.current_subset_df)
         removed_count = initial_count - final_count
 
         if removed_count > 0:
@@ -234,7 +368,7 @@ class SubsetSelector:
 
     def _show_save_subset_dialog(self):
         """Show dialog for saving the current subset."""
-        if not self.state.current_subset_list:
+        if self.state.current_subset_df.empty:
             st.warning("No sequences to save. Please select some sequences first.")
             st.session_state.show_save_dialog = False
             return
@@ -243,11 +377,11 @@ class SubsetSelector:
             st.write("### Save Current Subset")
             subset_name = st.text_input(
                 "Subset Name",
-                help="Enter a name for this subset (will be saved as .csv file)"
+                help="Enter a name for this subset (will be saved as a .parquet file)"
             )
 
             # Show preview of what will be saved
-            st.write(f"**Preview:** Saving {len(self.state.current_subset_list)} sequences")
+            st.write(f"**Preview:** Saving {len(self.state.current_subset_df)} sequences")
 
             col1, col2 = st.columns(2)
             with col1:
@@ -266,7 +400,7 @@ class SubsetSelector:
 
     def _show_load_subset_dialog(self):
         """Show dialog for loading a saved subset."""
-        available_subsets = self.api_client.get_available_subsets()
+        available_subsets = _load_subsets(self.api_client.base_url)
 
         if not available_subsets:
             st.info("No saved subsets found.")
@@ -299,16 +433,10 @@ class SubsetSelector:
     def _save_current_subset(self, name: str):
         """Save the current subset to the server."""
         # Convert sequences to the format expected by the API
-        subset_data = [
-            {
-                "videoset": seq.videoset,
-                "camera": seq.camera,
-                "annotation_suffix": seq.annotation_suffix
-            }
-            for seq in self.state.current_subset_list
-        ]
+        subset_data = self.state.current_subset_df[SUBSET_COLUMNS].to_dict("records")
 
         if self.api_client.save_subset(name, subset_data):
+            _fetch_subsets.clear()
             st.success(f"Successfully saved subset '{name}' with {len(subset_data)} sequences")
         else:
             st.error(f"Failed to save subset '{name}'")
@@ -321,29 +449,26 @@ class SubsetSelector:
             st.error(f"Failed to load subset '{name}' or subset is empty")
             return
 
-        # Clear current list and load new sequences
-        self.state.current_subset_list.clear()
+        # Replace the current subset with the loaded sequences
         self.state.sequences_per_suffix.clear()
-
-        for item in subset_data:
-            sequence = SequenceEntry(
-                videoset=item.get("videoset", ""),
-                camera=item.get("camera", ""),
-                annotation_suffix=item.get("annotation_suffix", "Undefined")
-            )
-            self.state.current_subset_list.append(sequence)
+        self.state.current_subset_df = make_subset_frame(
+            [item.get("videoset", "") for item in subset_data],
+            [item.get("camera", "") for item in subset_data],
+            [item.get("annotation_suffix", "Undefined") for item in subset_data],
+        )
 
         st.success(f"Successfully loaded subset '{name}' with {len(subset_data)} sequences")
 
     def render_current_sequences(self):
         """Display the current list of sequences."""
-        if not self.state.current_subset_list:
+        df = self.state.current_subset_df
+        if df.empty:
             return
 
         # Show summary statistics
-        total_sequences = len(self.state.current_subset_list)
-        defined_annotations = len([seq for seq in self.state.current_subset_list if seq.annotation_suffix != "Undefined"])
-        unique_videosets = len(set(seq.videoset for seq in self.state.current_subset_list))
+        total_sequences = len(df)
+        defined_annotations = int((df["annotation_suffix"] != "Undefined").sum())
+        unique_videosets = df["videoset"].nunique()
 
         col1, col2, col3 = st.columns(3)
         with col1:
@@ -353,17 +478,17 @@ class SubsetSelector:
         with col3:
             st.metric("Unique Videosets", unique_videosets)
 
-        # Convert to display format
-        display_data = [
-            {
-                "Videoset": seq.videoset,
-                "Camera": seq.camera,
-                "Annotation Suffix": seq.annotation_suffix
-            }
-            for seq in self.state.current_subset_list
-        ]
-
-        st.dataframe(display_data, use_container_width=True)
+        # Render the frame as-is, labels come from the column config instead of a renamed copy
+        st.dataframe(
+            df,
+            use_container_width=True,
+            column_order=SUBSET_COLUMNS,
+            column_config={
+                "videoset": "Videoset",
+                "camera": "Camera",
+                "annotation_suffix": "Annotation Suffix",
+            },
+        )
 
     def render_annotation_options(self):
         """Render annotation options and application buttons."""
@@ -391,14 +516,16 @@ class SubsetSelector:
 
     def _apply_annotation_suffix(self, suffix: str, sequences: List[str]):
         """Apply an annotation suffix to the specified sequences."""
-        updated_count = 0
-
-        for sequence in self.state.current_subset_list:
-            if sequence.sequence_id in sequences:
-                sequence.annotation_suffix = suffix
-                updated_count += 1
+        target = set(sequences)
+        if not target:
+            st.warning(f"No sequences found to apply suffix '{suffix}'")
+            return
 
+        df = self.state.current_subset_df
+        mask = df["sequence_id"].isin(target)
+        updated_count = int(mask.sum())
         if updated_count > 0:
+            df.loc[mask, "annotation_suffix"] = suffix
             st.success(f"Applied suffix '{suffix}' to {updated_count} sequences")
             st.rerun()
         else:
@@ -419,7 +546,7 @@ class SubsetSelector:
         videoset_pattern, camera_pattern = self.render_pattern_inputs()
 
         # Action buttons
-        col1, col2 = st.columns(2)
+        col1, col2, col3 = st.columns(3)
 
         with col1:
             if st.button("Find Matching Sequences", type="primary"):
@@ -429,8 +556,15 @@ class SubsetSelector:
             if st.button("Fetch Annotation Options", type="primary"):
                 self.fetch_annotation_options()
 
+        with col3:
+            if st.button("Refresh", help="Reload videosets and saved subsets from the API"):
+                self._refresh()
+            if st.button("Clear annotation cache", help="Fetch annotation options from the API again"):
+                self.api_client.clear_annotation_options_cache()
+                st.success("Cleared cached annotation options")
+
         # Current sequences management
-        if self.state.current_subset_list:
+        if not self.state.current_subset_df.empty:
             st.divider()
             self.render_sequence_management_buttons()
             self.render_current_sequences()
@@ -1,83 +1,166 @@
+# The read-only tests can run in parallel: pytest -n auto --dist loadgroup test_api.py
+# Tests that write server state share the "backend_state" group, so they stay on one worker.
 import os
 import subprocess
 import time
 
+import orjson
 import pytest
 import requests
+from requests.adapters import HTTPAdapter
 
+# Point the tests at another backend with XT_BACKEND=http://host:port
+BASE = os.environ.get("XT_BACKEND", "http://127.0.0.1:5000")
+# (connect, read) timeouts, so a hung backend fails the test instead of stalling the run
+TIMEOUT = (1.0, 10.0)
+VIDEOSET = 'leusderheide_20230705'
+CAMERA = 'visual_halfres/CPFS7_0310'
+TIMESERIES = 'detections/yolov8x_mscoco.csv'
+JSON_HEADERS = {"Content-Type": "application/json"}
+SUBSET = {
+	"name": "test_subset",
+	"data": [
+		{"videoset": "a", "camera": "b", "annotation_suffix": "c"}
+	]
+}
+# Serialized once, posted as-is
+SUBSET_BODY = orjson.dumps(SUBSET)
+
+
+def j(response):
+	"""Decode a JSON response with orjson."""
+	return orjson.loads(response.content)
 
 @pytest.fixture(scope="module")
 def api_server():
-	yield "http://127.0.0.1:5000"
+	yield BASE
+
+@pytest.fixture(scope="session")
+def client():
+	# One pooled session for the whole run, so tests reuse keep-alive connections
+	session = requests.Session()
+	session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+	yield session
+	session.close()
 
-def test_get_timestamps(api_server):
+@pytest.fixture(scope="session", autouse=True)
+def _warmup(client):
+	# Wait for the backend to answer before the first test, skip the run if it never does
+	for _ in range(3):
+		try:
+			if client.get(f"{BASE}/health", timeout=2).ok:
+				return
+		except requests.RequestException:
+			pass
+		time.sleep(0.5)
+	pytest.skip(f"backend not available at {BASE}")
+
+@pytest.fixture(scope="module")
+def camera_params():
 	# These are example parameters. You might need to adjust them based on your actual data.
-	params = {
-		'videoset_name': 'leusderheide_20230705',
-		'camera': 'visual_halfres/CPFS7_0310'
-	}
-	response = requests.get(f"{api_server}/timestamps", params=params)
-	assert response.status_code == 200
-	assert isinstance(response.json(), list)
-
-def test_get_timeseries_options(api_server):
-	params = {
-		'videoset_name': 'leusderheide_20230705',
-		'camera': 'visual_halfres/CPFS7_0310'
-	}
-	response = requests.get(f"{api_server}/timeseries_options", params=params)
-	assert response.status_code == 200
-	assert isinstance(response.json(), list)
-
-def test_get_column_options(api_server):
-	params = {
-		'videoset_name': 'leusderheide_20230705',
-		'camera': 'visual_halfres/CPFS7_0310',
-		'timeseries_name': 'detections/yolov8x_mscoco.csv'
-	}
-	response = requests.get(f"{api_server}/column_options", params=params)
-	assert response.status_code == 200
-	assert isinstance(response.json(), list)
-
-def test_get_timeseries_data(api_server):
-	params = {
-		'videoset_name': 'leusderheide_20230705',
-		'camera': 'visual_halfres/CPFS7_0310',
-		'timeseries_name': 'detections/yolov8x_mscoco.csv',
-		'y_column': 'bbox_x',
-		'z_column': 'confidence',
-	}
-	response = requests.get(f"{api_server}/timeseries_data", params=params)
+	return {'videoset_name': VIDEOSET, 'camera': CAMERA}
+
+@pytest.fixture(scope="module")
+def timestamps(api_server, client, camera_params):
+	response = client.get(f"{api_server}/timestamps", params=camera_params, timeout=TIMEOUT)
 	assert response.status_code == 200
-	data = response.json()
-	assert 'x' in data
-	assert 'y' in data
-	assert 'z' in data
+	return j(response)
 
-def test_get_subsets(api_server):
-	response = requests.get(f"{api_server}/subsets")
+@pytest.fixture(scope="module")
+def timeseries_options(api_server, client, camera_params):
+	response = client.get(f"{api_server}/timeseries_options", params=camera_params, timeout=TIMEOUT)
 	assert response.status_code == 200
-	assert isinstance(response.json(), list)
+	return j(response)
 
-def test_get_subset(api_server):
+@pytest.fixture(scope="module")
+def timeseries_params(camera_params, timeseries_options):
+	if TIMESERIES not in timeseries_options:
+		pytest.skip(f"{TIMESERIES} is not available for {CAMERA}")
+	return {**camera_params, 'timeseries_name': TIMESERIES}
+
+def test_get_timestamps(timestamps):
+	assert isinstance(timestamps, list)
+
+def test_get_timeseries_options(timeseries_options):
+	assert isinstance(timeseries_options, list)
+
+class TestWithTimeseries:
+	"""Tests that read the example timeseries, grouped so they share its fixtures."""
+
+	def test_get_column_options(self, api_server, client, timeseries_params):
+		# The body is only read once the status check passed
+		with client.get(f"{api_server}/column_options", params=timeseries_params, stream=True, timeout=TIMEOUT) as response:
+			assert response.status_code == 200
+			assert isinstance(j(response), list)
+
+	def test_get_timeseries_data(self, api_server, client, timeseries_params):
+		params = {**timeseries_params, 'y_column': 'bbox_x', 'z_column': 'confidence'}
+		response = client.get(f"{api_server}/timeseries_data", params=params, timeout=TIMEOUT)
+		assert response.status_code == 200
+		data = j(response)
+		assert 'x' in data
+		assert 'y' in data
+		assert 'z' in data
+
+	def test_get_timeseries_at_timestamp(self, api_server, client, timeseries_params):
+		# Use a timestamp the timeseries actually has, so the lookup must return rows
+		response = client.get(f"{api_server}/timeseries_data", params=timeseries_params, timeout=TIMEOUT)
+		assert response.status_code == 200
+		x = j(response)['x']
+		if not x:
+			pytest.skip(f"{TIMESERIES} has no rows")
+		timestamp = x[0]
+		params = {**timeseries_params, 'timestamp': timestamp}
+		response = client.get(f"{api_server}/timeseries_at_timestamp", params=params, timeout=TIMEOUT)
+		assert response.status_code == 200
+		records = j(response)
+		assert isinstance(records, list)
+		assert records
+		assert all(abs(record['timestamp'] - timestamp) < 1e-6 for record in records)
+
+def test_get_frame(api_server, client, timestamps):
+	if not timestamps:
+		pytest.skip(f"{CAMERA} has no frames")
+	camera = CAMERA.replace("/", "___")
+	# Only the headers are checked, so don't download the image
+	url = f"{api_server}/frame/{VIDEOSET}/{camera}/{timestamps[0]}"
+	with client.get(url, stream=True, timeout=TIMEOUT) as response:
+		assert response.status_code == 200
+		assert response.headers["Content-Type"] == "image/jpeg"
+		assert int(response.headers.get("Content-Length", 1)) > 0
+		etag = response.headers["ETag"]
+
+	# A repeat request with the ETag is answered without a body
+	response = client.get(url, headers={"If-None-Match": etag}, timeout=TIMEOUT)
+	assert response.status_code == 304
+	assert not response.content
+
+@pytest.mark.parametrize("path, expected_type, keys", [
+	("/health", dict, ["status"]),
+	("/videosets", dict, []),
+	("/subsets", list, []),
 	# Assuming 'my_subset' exists from the example
-	response = requests.get(f"{api_server}/subset/my_subset")
-	assert response.status_code == 200
-	assert isinstance(response.json(), list)
-
-def test_save_subset(api_server):
-	data = {
-		"name": "test_subset",
-		"data": [
-			{"videoset": "a", "camera": "b", "annotation_suffix": "c"}
-		]
-	}
-	response = requests.post(f"{api_server}/subset", json=data)
+	("/subset/my_subset", list, []),
+])
+def test_get_endpoint(api_server, client, path, expected_type, keys):
+	# The body is only read once the status check passed
+	with client.get(f"{api_server}{path}", stream=True, timeout=TIMEOUT) as response:
+		assert response.status_code == 200
+		data = j(response)
+	assert isinstance(data, expected_type)
+	for key in keys:
+		assert key in data
+
+@pytest.mark.xdist_group("backend_state")
+def test_save_subset(api_server, client):
+	response = client.post(
+		f"{api_server}/subset", data=SUBSET_BODY, headers=JSON_HEADERS, timeout=TIMEOUT
+	)
 	assert response.status_code == 200
-	assert response.json() == {"success": True}
+	assert j(response) == {"success": True}
 
 	# check if the file was created
-	response = requests.get(f"{api_server}/subset/test_subset")
+	response = client.get(f"{api_server}/subset/test_subset", timeout=TIMEOUT)
 	assert response.status_code == 200
-	assert response.json() == data['data']
+	assert j(response) == SUBSET['data']
 